@@ -19,6 +19,19 @@ class GripperEnvironmentConfig(cares_cfg.SubscriptableClass):
     # Aruco or STAG Marker size in mm
     marker_size: Optional[int] = 18  # mm
 
+    # Frames are scaled by this factor before marker detection - 1 disables
+    detection_scale: Optional[float] = 1.0
+
+    # Reuse the last marker poses without a new capture while the gripper is idle - 0 disables
+    pose_reuse_period: Optional[float] = 0.0  # secs
+
+    # Velocity actions at or below this magnitude leave the gripper idle
+    idle_velocity_threshold: Optional[int] = 0
+
+    # Run policy updates on a background thread, dropping them while it is behind
+    # Overlaps training with the gripper, but G no longer fixes the updates per step
+    background_training: Optional[bool] = False
+
     # Aruco Marker ID for the object
     object_marker_id: Optional[int] = 7
 
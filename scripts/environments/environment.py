@@ -1,9 +1,13 @@
 import logging
-import random
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from functools import wraps
 
+import cv2
+import numpy as np
+import tools.utils as utils
 from cares_lib.dynamixel.Gripper import Gripper
 from cares_lib.dynamixel.gripper_configuration import GripperConfig
 from cares_lib.vision.ArucoDetector import ArucoDetector
@@ -61,17 +65,65 @@ class Environment(ABC):
     ):
         self.task = env_config.task
 
+        # All environment sampling shares one generator
+        self._rng = utils.create_rng()
+
         self.gripper = Gripper(gripper_config)
         self.camera = Camera(
             env_config.camera_id, env_config.camera_matrix, env_config.camera_distortion
         )
 
+        # Calibration never changes after the camera is opened
+        # Detection runs on downscaled frames so the focal lengths and centre are scaled to match
+        self.detection_scale = env_config.detection_scale
+        camera_matrix = np.asarray(self.camera.camera_matrix, dtype=np.float64)
+        self._camera_matrix = (
+            np.diag([self.detection_scale, self.detection_scale, 1.0]) @ camera_matrix
+        )
+        # Resizing aligns pixel centres - cx' = s * (cx + 0.5) - 0.5, not s * cx
+        self._camera_matrix[0:2, 2] = (
+            self.detection_scale * (camera_matrix[0:2, 2] + 0.5) - 0.5
+        )
+        self._camera_distortion = self.camera.camera_distortion
+
         self.action_type = gripper_config.action_type
 
+        # Per servo action bounds used to map between gripper and algorithm ranges
+        num_motors = gripper_config.num_motors
+        if self.action_type == "velocity":
+            action_min = np.full(
+                num_motors, gripper_config.velocity_min, dtype=np.float64
+            )
+            action_max = np.full(
+                num_motors, gripper_config.velocity_max, dtype=np.float64
+            )
+        else:
+            action_min = np.array(gripper_config.min_values, dtype=np.float64)
+            action_max = np.array(gripper_config.max_values, dtype=np.float64)
+        self._action_min = action_min
+        self._action_half_range = (action_max - action_min) / 2.0
+        self._action_scratch = np.empty(num_motors, dtype=np.float64)
+
+        # Worker used to overlap camera capture with serial I/O to the servos
+        self._io_pool = ThreadPoolExecutor(max_workers=1)
+
         self.gripper.wiggle_home()
 
         self.aruco_detector = ArucoDetector(marker_size=env_config.marker_size)
 
+        # Marker poses of the last detected frame - reused while the frame is unchanged
+        self._last_frame_hash = None
+        self._marker_pose_cache = {}
+        self._last_detection_time = 0.0
+
+        self.pose_reuse_period = env_config.pose_reuse_period
+        self.idle_velocity_threshold = env_config.idle_velocity_threshold
+        self._last_action = None
+        self._last_action_idle = False
+
+        # Latest frame used for detection, all markers in it are detected in one pass
+        self.current_frame = None
+
         self.step_counter = 0
         self.episode_horizon = env_config.episode_horizon
 
@@ -106,35 +158,35 @@ class Environment(ABC):
         self.step_counter = 0
 
         self._reset()
+        self._invalidate_marker_cache()
+        self._last_action = None
+        self._last_action_idle = False
 
         self.previous_environment_info = current_environment_info = (
             self._get_environment_info()
         )
         state = self._environment_info_to_state(current_environment_info)
 
-        logging.debug(f"{current_environment_info}")
+        logging.debug("%s", current_environment_info)
 
         # choose goal will crash if not home
         self.goal = self._choose_goal()
 
-        logging.debug(f"New Goal Generated: {self.goal}")
+        logging.debug("New Goal Generated: %s", self.goal)
         return state
 
     def sample_action_position(self):
-        action = []
-        for i in range(0, self.gripper.num_motors):
-            min_value = self.gripper.min_values[i]
-            max_value = self.gripper.max_values[i]
-            action.append(random.randint(min_value, max_value))
-        return action
+        return self._rng.integers(
+            self.gripper.min_values, self.gripper.max_values, endpoint=True
+        ).tolist()
 
     def sample_action_velocity(self):
-        action = []
-        for _ in range(0, self.gripper.num_motors):
-            action.append(
-                random.randint(self.gripper.velocity_min, self.gripper.velocity_max)
-            )
-        return action
+        return self._rng.integers(
+            self.gripper.velocity_min,
+            self.gripper.velocity_max,
+            size=self.gripper.num_motors,
+            endpoint=True,
+        ).tolist()
 
     def sample_action(self):
         if self.action_type == "velocity":
@@ -162,6 +214,14 @@ class Environment(ABC):
         else:
             self.gripper.move(action)
 
+        # Previously detected poses are stale once the gripper has been commanded to move
+        # The previous step must also be idle, its poses were taken mid-motion
+        action_idle = self._is_idle_action(action)
+        if not (action_idle and self._last_action_idle):
+            self._invalidate_marker_cache()
+        self._last_action_idle = action_idle
+        self._last_action = list(action)
+
         current_environment_info = self._get_environment_info()
         state = self._environment_info_to_state(current_environment_info)
 
@@ -183,58 +243,93 @@ class Environment(ABC):
 
     def denormalize(self, action_norm):
         # return action in gripper range [-min, +max] for each servo
-        action_gripper = [0 for _ in range(0, len(action_norm))]
-        min_value_in = -1
-        max_value_in = 1
-        for i in range(0, self.gripper.num_motors):
-            if self.action_type == "velocity":
-                servo_min_value = self.gripper.velocity_min
-                servo_max_value = self.gripper.velocity_max
-            else:
-                servo_min_value = self.gripper.min_values[i]
-                servo_max_value = self.gripper.max_values[i]
-            action_gripper[i] = int(
-                (action_norm[i] - min_value_in)
-                * (servo_max_value - servo_min_value)
-                / (max_value_in - min_value_in)
-                + servo_min_value
-            )
-        return action_gripper
+        action_gripper = np.empty(self.gripper.num_motors, dtype=int)
+        return self.denormalize_into(action_gripper, action_norm).tolist()
+
+    def denormalize_into(self, out, action_norm):
+        # writes the action in gripper range into out, truncating like int() when out is integer
+        scratch = self._action_scratch
+        np.add(action_norm, 1.0, out=scratch)
+        np.multiply(scratch, self._action_half_range, out=scratch)
+        np.add(scratch, self._action_min, out=scratch)
+        out[...] = scratch
+        return out
 
     def normalize(self, action_gripper):
         # return action in algorithm range [-1, +1]
-        max_range_value = 1
-        min_range_value = -1
-        action_norm = [0 for _ in range(0, len(action_gripper))]
-        for i in range(0, self.gripper.num_motors):
-            if self.action_type == "velocity":
-                servo_min_value = self.gripper.velocity_min
-                servo_max_value = self.gripper.velocity_max
-            else:
-                servo_min_value = self.gripper.min_values[i]
-                servo_max_value = self.gripper.max_values[i]
-            action_norm[i] = (action_gripper[i] - servo_min_value) * (
-                max_range_value - min_range_value
-            ) / (servo_max_value - servo_min_value) + min_range_value
-        return action_norm
+        action_norm = np.empty(self.gripper.num_motors, dtype=np.float64)
+        return self.normalize_into(action_norm, action_gripper).tolist()
+
+    def normalize_into(self, out, action_gripper):
+        # writes the action in algorithm range [-1, +1] into out
+        np.subtract(action_gripper, self._action_min, out=out)
+        np.divide(out, self._action_half_range, out=out)
+        np.subtract(out, 1.0, out=out)
+        return out
+
+    def _is_idle_action(self, action):
+        if self.action_type == "velocity":
+            return (
+                max(abs(velocity) for velocity in action)
+                <= self.idle_velocity_threshold
+            )
+        return self._last_action is not None and list(action) == self._last_action
 
     def _get_marker_poses(self, marker_ids, blindable=False):
+        # Skip the capture entirely while the gripper is idle and the last detection is recent
+        if (
+            time.monotonic() - self._last_detection_time < self.pose_reuse_period
+            and all(ids in self._marker_pose_cache for ids in marker_ids)
+        ):
+            return self._marker_pose_cache
+
+        camera_matrix = self._camera_matrix
+        camera_distortion = self._camera_distortion
+
         while not blindable:
-            logging.debug(f"Attempting to Detect markers: {marker_ids}")
+            logging.debug("Attempting to Detect markers: %s", marker_ids)
             frame = self.camera.get_frame()
-            marker_poses = self.aruco_detector.get_marker_poses(
-                frame,
-                self.camera.camera_matrix,
-                self.camera.camera_distortion,
-                display=True,
-            )
+            self.current_frame = frame
+
+            # Hash a downsampled copy of the frame to detect repeated frames cheaply
+            frame_hash = hash(frame[::8, ::8, 0].tobytes())
+            if frame_hash == self._last_frame_hash:
+                marker_poses = self._marker_pose_cache
+            else:
+                detection_frame = frame
+                if self.detection_scale != 1.0:
+                    detection_frame = cv2.resize(
+                        frame,
+                        None,
+                        fx=self.detection_scale,
+                        fy=self.detection_scale,
+                        interpolation=cv2.INTER_AREA,
+                    )
+                marker_poses = self.aruco_detector.get_marker_poses(
+                    detection_frame,
+                    camera_matrix,
+                    camera_distortion,
+                    # Detection may run on the I/O worker - only the render thread draws
+                    display=False,
+                )
+                self._last_frame_hash = frame_hash
+                self._marker_pose_cache = marker_poses
+                self._last_detection_time = time.monotonic()
 
             # This will check that all the markers are detected correctly
             if all(ids in marker_poses for ids in marker_ids):
                 break
 
+            # Show the operator what the camera sees while the markers are searched for
+            missing_marker_ids = [ids for ids in marker_ids if ids not in marker_poses]
+            self._render_detection_retry(frame, missing_marker_ids)
+
         return marker_poses
 
+    def _invalidate_marker_cache(self):
+        self._last_frame_hash = None
+        self._marker_pose_cache = {}
+
     @abstractmethod
     def _reset(self):
         pass
@@ -258,3 +353,7 @@ class Environment(ABC):
     @abstractmethod
     def _render_envrionment(self, state, environment_info):
         pass
+
+    @abstractmethod
+    def _render_detection_retry(self, frame, missing_marker_ids):
+        pass
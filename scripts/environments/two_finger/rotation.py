@@ -26,22 +26,16 @@ class GOAL_SELECTION_METHOD(Enum):
 # fixed_goal and fixed_goals functions have not been used for awhile in our relative experiments and it can already encompass them.
 
 
+_TARGET_ANGLES = (90, 180, 270, 0)
+
+
 def fixed_goal():
     """
     Selects a random fixed goal from predefined options.
     Returns:
         int: Chosen target angle.
     """
-    target_angle = np.random.randint(1, 5)
-    if target_angle == 1:
-        return 90
-    elif target_angle == 2:
-        return 180
-    elif target_angle == 3:
-        return 270
-    elif target_angle == 4:
-        return 0
-    return 90
+    return _TARGET_ANGLES[random.getrandbits(2)]
 
 
 def fixed_goals(object_current_pose, noise_tolerance):
@@ -1,12 +1,37 @@
 import logging
 import math
-from random import randrange
 
+import numpy as np
 from cares_lib.dynamixel.gripper_configuration import GripperConfig
 from configurations import GripperEnvironmentConfig
 from environments.two_finger.two_finger import TwoFingerTask
 
 
+def translation_reward(
+    target_x, target_y, previous_x, previous_y, current_x, current_y, tolerance
+):
+    """
+    Computes the translation reward from scalar goal and object positions.
+
+    Returns:
+    tuple: The reward and whether the object has reached the goal.
+    """
+    dx_after = target_x - current_x
+    dy_after = target_y - current_y
+    goal_distance_after_squared = dx_after * dx_after + dy_after * dy_after
+
+    # Compare squared distances so the sqrt is only paid when computing progress
+    if goal_distance_after_squared <= tolerance * tolerance:
+        return 500, True
+
+    dx_before = target_x - previous_x
+    dy_before = target_y - previous_y
+    goal_distance_before = math.sqrt(dx_before * dx_before + dy_before * dy_before)
+    goal_distance_after = math.sqrt(goal_distance_after_squared)
+
+    return goal_distance_before - goal_distance_after, False
+
+
 class TwoFingerTranslation(TwoFingerTask):
     def __init__(
         self,
@@ -23,57 +48,78 @@ class TwoFingerTranslation(TwoFingerTask):
             f"Goal Min: {self.goal_min} Goal Max: {self.goal_max} Tolerance: {self.noise_tolerance}"
         )
 
+        # Servo positions (+ velocities) + Servo and Finger Tip markers + Object + Goal
+        num_motors = gripper_config.num_motors
+        num_velocities = num_motors if gripper_config.action_type == "velocity" else 0
+        self._state_dim = num_motors + num_velocities + 2 * (num_motors + 2) + 2 + 2
+        self._state_buffer = np.zeros(self._state_dim, dtype=np.float32)
+
+        # Goals are drawn in batches, the first batch is drawn on the first goal
+        self._goal_batch_size = 1024
+        self._goal_batch = None
+        self._goal_index = self._goal_batch_size
+
         super().__init__(env_config, gripper_config)
 
+    def _sample_goal_batch(self):
+        return self._rng.integers(
+            low=[int(bound) for bound in self.goal_min],
+            high=[int(bound) for bound in self.goal_max],
+            size=(self._goal_batch_size, 2),
+        )
+
     # overriding method
     def _choose_goal(self):
-        x1, y1 = self.goal_min
-        x2, y2 = self.goal_max
+        if self._goal_index == self._goal_batch_size:
+            self._goal_batch = self._sample_goal_batch()
+            self._goal_index = 0
 
-        goal_x = randrange(x1, x2)
-        goal_y = randrange(y1, y2)
+        goal = self._goal_batch[self._goal_index]
+        self._goal_index += 1
 
-        return [goal_x, goal_y]
+        return goal.tolist()
 
     # overriding method
     def _environment_info_to_state(self, environment_info):
-        state = []
+        state = self._state_buffer
+        num_motors = self.gripper.num_motors
 
         # Servo Angles - Steps
-        state += environment_info["gripper"]["positions"]
+        state[0:num_motors] = environment_info["gripper"]["positions"]
+        index = num_motors
 
         # Servo Velocities - Steps per second
         if self.action_type == "velocity":
-            state += environment_info["gripper"]["velocities"]
+            state[index : index + num_motors] = environment_info["gripper"][
+                "velocities"
+            ]
+            index += num_motors
 
         # Servo + Two Finger Tips - X Y mm
-        for i in range(1, self.gripper.num_motors + 3):
+        for i in range(1, num_motors + 3):
             servo_position = environment_info["poses"]["gripper"][i]
-            state += self._pose_to_state(servo_position)
+            state[index : index + 2] = self._pose_to_state(servo_position)
+            index += 2
 
         # Object - X Y mm
-        state += self._pose_to_state(environment_info["poses"]["object"])
+        state[index : index + 2] = self._pose_to_state(
+            environment_info["poses"]["object"]
+        )
+        index += 2
 
-        # Goal State - X Y mm
-        state += self.goal
+        # Goal State - X Y mm - no goal has been chosen yet on the first reset
+        if self.goal:
+            state[index : index + 2] = self.goal
 
-        return state
+        # Copy as the memory buffer keeps a reference to every returned state
+        return state.copy()
 
     # overriding method
     def _reward_function(self, previous_environment_info, current_environment_info):
-        done = False
-
-        reward = 0
-
         target_goal = current_environment_info["goal"]
 
-        object_previous = previous_environment_info["poses"]["object"]["position"][0:2]
-        object_current = current_environment_info["poses"]["object"]["position"][0:2]
-
-        goal_distance_before = math.dist(target_goal, object_previous)
-        goal_distance_after = math.dist(target_goal, object_current)
-
-        goal_progress = goal_distance_before - goal_distance_after
+        object_previous = previous_environment_info["poses"]["object"]["position"]
+        object_current = current_environment_info["poses"]["object"]["position"]
 
         # The following step might improve the performance.
 
@@ -87,15 +133,24 @@ class TwoFingerTranslation(TwoFingerTask):
         #     #reward = reward if reward > 0 else 0
 
         # For Translation. noise_tolerance is 15, it would affect the performance to some extent.
-        if goal_distance_after <= self.noise_tolerance:
+        reward, done = translation_reward(
+            float(target_goal[0]),
+            float(target_goal[1]),
+            float(object_previous[0]),
+            float(object_previous[1]),
+            float(object_current[0]),
+            float(object_current[1]),
+            float(self.noise_tolerance),
+        )
+
+        if done:
             logging.info("----------Reached the Goal!----------")
-            done = True
-            reward = 500
-        else:
-            reward += goal_progress
 
         logging.debug(
-            f"Object Pose: {object_current} Goal Pose: {target_goal} Reward: {reward}"
+            "Object Pose: %s Goal Pose: %s Reward: %s",
+            object_current[0:2],
+            target_goal,
+            reward,
         )
 
         return reward, done
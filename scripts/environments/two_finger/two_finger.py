@@ -1,6 +1,10 @@
+import logging
+import queue
+import threading
 from abc import abstractmethod
 
 import cv2
+import numpy as np
 import tools.utils as utils
 from cares_lib.dynamixel.gripper_configuration import GripperConfig
 from configurations import GripperEnvironmentConfig
@@ -13,6 +17,14 @@ class TwoFingerTask(Environment):
         env_config: GripperEnvironmentConfig,
         gripper_config: GripperConfig,
     ):
+        # Rendering runs on its own thread so it never blocks a step - only the latest frame is kept
+        self._render_queue = queue.Queue(maxsize=1)
+        self._undistort_maps = None
+        self._undistort_buffer = None
+        self._goal_bounds_pixels = None
+        self._render_thread = threading.Thread(target=self._render_loop, daemon=True)
+        self._render_thread.start()
+
         super().__init__(env_config, gripper_config)
 
     @abstractmethod
@@ -62,9 +74,16 @@ class TwoFingerTask(Environment):
         Returns:
         A list representing the state of the environment.
         """
+        # Camera capture and servo reads are independent I/O so run them concurrently
+        poses_future = self._io_pool.submit(self._get_poses)
+
         environment_info = {}
-        environment_info["gripper"] = self.gripper.state()
-        environment_info["poses"] = self._get_poses()
+        try:
+            environment_info["gripper"] = self.gripper.state()
+        finally:
+            # Always wait for the capture so it cannot write stale poses into the cache
+            poses = poses_future.result()
+        environment_info["poses"] = poses
         environment_info["goal"] = self.goal
 
         return environment_info
@@ -85,25 +104,73 @@ class TwoFingerTask(Environment):
         return state
 
     def _render_envrionment(self, state, environment_state):
+        # Draw on the frame the state was detected from rather than capturing another
+        self._queue_render(
+            self._draw_environment,
+            self.current_frame,
+            state,
+            environment_state,
+            list(self.goal),
+        )
 
-        image = self.camera.get_frame()
+    def _render_detection_retry(self, frame, missing_marker_ids):
+        self._queue_render(self._draw_detection_retry, frame, missing_marker_ids)
+
+    def _queue_render(self, draw, *args):
+        # Drop the stale frame if the render thread has not caught up yet
+        try:
+            self._render_queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._render_queue.put_nowait((draw, args))
+
+    def _render_loop(self):
+        # HighGUI is not thread safe - this thread makes every imshow/waitKey call
+        while True:
+            draw, args = self._render_queue.get()
+            try:
+                draw(*args)
+            except Exception as error:
+                # Rendering is display only - never let it take down the render thread
+                logging.error(f"Failed to render environment: {error}")
+
+    def _draw_environment(self, image, state, environment_state, goal):
+        # Undistortion maps and the output image are built once and reused for every frame
+        if self._undistort_maps is None:
+            height, width = image.shape[:2]
+            self._undistort_maps = cv2.initUndistortRectifyMap(
+                self.camera.camera_matrix,
+                self.camera.camera_distortion,
+                None,
+                self.camera.camera_matrix,
+                (width, height),
+                cv2.CV_16SC2,
+            )
+            self._undistort_buffer = np.empty_like(image)
 
-        image = cv2.undistort(
-            image, self.camera.camera_matrix, self.camera.camera_distortion
+        image = cv2.remap(
+            image,
+            *self._undistort_maps,
+            cv2.INTER_LINEAR,
+            dst=self._undistort_buffer,
         )
 
-        # Draw the goal boundry
+        # Draw the goal boundry - the bounds and reference marker are fixed so map them once
         bounds_color = (0, 255, 0)
-        bounds_min_x, bounds_min_y = utils.position_to_pixel(
-            self.goal_min, self.reference_position, self.camera.camera_matrix
-        )
-        bounds_max_x, bounds_max_y = utils.position_to_pixel(
-            self.goal_max, self.reference_position, self.camera.camera_matrix
-        )
+        if self._goal_bounds_pixels is None:
+            self._goal_bounds_pixels = (
+                utils.position_to_pixel(
+                    self.goal_min, self.reference_position, self.camera.camera_matrix
+                ),
+                utils.position_to_pixel(
+                    self.goal_max, self.reference_position, self.camera.camera_matrix
+                ),
+            )
+        bounds_min_pixel, bounds_max_pixel = self._goal_bounds_pixels
         cv2.rectangle(
             image,
-            (int(bounds_min_x), int(bounds_min_y)),
-            (int(bounds_max_x), int(bounds_max_y)),
+            bounds_min_pixel,
+            bounds_max_pixel,
             bounds_color,
             2,
         )
@@ -126,7 +193,7 @@ class TwoFingerTask(Environment):
             object_pose["position"][2],
         ]
         goal_pixel = utils.position_to_pixel(
-            self.goal, goal_reference_position, self.camera.camera_matrix
+            goal, goal_reference_position, self.camera.camera_matrix
         )
         cv2.circle(image, goal_pixel, 9, goal_color, -1)
 
@@ -146,7 +213,8 @@ class TwoFingerTask(Environment):
                 environment_state["poses"]["gripper"][i + 1]["position"][2],
             ]
 
-            reference = self.reference_position
+            # Copy so the cached reference marker pose is not modified
+            reference = list(self.reference_position)
             reference[2] = position[2]
             marker_pixel = utils.position_to_pixel(
                 position,
@@ -167,4 +235,20 @@ class TwoFingerTask(Environment):
             )
 
         cv2.imshow("State Image", image)
-        cv2.waitKey(10)
+        cv2.waitKey(1)
+
+    def _draw_detection_retry(self, image, missing_marker_ids):
+        # Copy so the captured frame is left untouched for detection
+        image = image.copy()
+        cv2.putText(
+            image,
+            f"Searching for markers: {missing_marker_ids}",
+            (10, 30),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1,
+            (0, 0, 255),
+            2,
+            cv2.LINE_AA,
+        )
+        cv2.imshow("Marker Detection", image)
+        cv2.waitKey(1)
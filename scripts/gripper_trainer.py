@@ -1,11 +1,17 @@
 import logging
+import queue
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import NamedTuple
 
+import numpy as np
 import tools.error_handlers as erh
+import torch
 from cares_lib.dynamixel.Gripper import GripperError
 from cares_lib.dynamixel.gripper_configuration import GripperConfig
-from cares_reinforcement_learning.memory import MemoryBuffer
 from cares_reinforcement_learning.util import Record
 from cares_reinforcement_learning.util.configurations import (
     AlgorithmConfig,
@@ -14,9 +20,42 @@ from cares_reinforcement_learning.util.configurations import (
 from configurations import GripperEnvironmentConfig
 from environments.environment_factory import EnvironmnetFactory
 from networks.NetworkFactory import NetworkFactory
+from tools.memory_buffer import SoAMemoryBuffer
 
 logging.basicConfig(level=logging.INFO)
 
+# Video frames waiting on the encoder before the evaluation loop blocks
+MAX_PENDING_VIDEO_FRAMES = 8
+
+# Exploration progress is only logged every this many steps
+EXPLORATION_LOG_FREQUENCY = 256
+
+# Training requests waiting on the trainer thread before new ones are dropped
+MAX_PENDING_TRAINING_REQUESTS = 4
+
+# Recovered resets attempted before giving up on the gripper
+MAX_RESET_RETRIES = 10
+
+
+class EpisodeProgress(NamedTuple):
+    """
+    Progress of the current training episode, carried from one phase to the next.
+    """
+
+    number: int = 0
+    timesteps: int = 0
+    reward: float = 0
+    start_time: float = 0.0
+    evaluate: bool = False
+
+
+def _extrinsic_reward(state, action, next_state, reward_extrinsic):
+    return reward_extrinsic
+
+
+def _skip_training(total_step_counter):
+    pass
+
 
 class GripperTrainer:
     def __init__(
@@ -66,7 +105,23 @@ class GripperTrainer:
             observation_size, action_num, alg_config
         )
 
-        self.memory = MemoryBuffer(training_config.buffer_size)
+        # Scratch arrays reused every step for mapping actions between ranges
+        self._action_scratch = np.empty(action_num, dtype=np.float32)
+        self._action_env_scratch = np.empty(action_num, dtype=int)
+
+        self.memory = SoAMemoryBuffer(
+            training_config.buffer_size, observation_size, action_num
+        )
+
+        # Minibatch arrays filled in place by every training iteration
+        batch_size = training_config.batch_size
+        self._batch = (
+            np.empty((batch_size, observation_size), dtype=np.float32),
+            np.empty((batch_size, action_num), dtype=np.float32),
+            np.empty(batch_size, dtype=np.float32),
+            np.empty((batch_size, observation_size), dtype=np.float32),
+            np.empty(batch_size, dtype=np.float32),
+        )
 
         # TODO: reconcile deep file_path dependency
         self.file_path = f'{datetime.now().strftime("%Y_%m_%d_%H:%M:%S")}-gripper-{gripper_config.gripper_id}-{env_config.task}-{alg_config.algorithm}'
@@ -84,6 +139,19 @@ class GripperTrainer:
         self.record.save_config(training_config, "training_config")
         self.record.save_config(gripper_config, "gripper_config")
 
+        # Video frames are encoded on a single worker so ordering is preserved
+        self._video_pool = ThreadPoolExecutor(max_workers=1)
+        self._video_futures = deque()
+
+        # With background_training enabled policy updates run on a trainer thread
+        # The agent lock guards the networks and the memory lock guards the replay buffer
+        self._agent_lock = threading.Lock()
+        self._memory_lock = threading.Lock()
+        self._train_queue = queue.Queue(maxsize=MAX_PENDING_TRAINING_REQUESTS)
+        self._train_thread = None
+        self._train_error = None
+        self._dropped_training_requests = 0
+
     def environment_reset(self):
         """
         Attempts to reset the environment and handle any encountered errors.
@@ -95,21 +163,20 @@ class GripperTrainer:
         EnvironmentError: If there's an error related to the environment during reset.
         GripperError: If there's an error related to the gripper during reset.
         """
-        try:
-            return self.environment.reset()
-        except (EnvironmentError, GripperError) as error:
-            error_message = f"Failed to reset with message: {error}"
-            logging.error(error_message)
-            if erh.handle_gripper_error_home(
-                self.environment, error_message, self.file_path
-            ):
-                return (
-                    self.environment_reset()
-                )  # might keep looping if it keep having issues
-            else:
-                self.environment.gripper.close()
-                self.agent.save_models("error_models", self.file_path)
-                exit(1)
+        for _ in range(MAX_RESET_RETRIES):
+            try:
+                return self.environment.reset()
+            except (EnvironmentError, GripperError) as error:
+                error_message = f"Failed to reset with message: {error}"
+                logging.error(error_message)
+                if not erh.handle_gripper_error_home(
+                    self.environment, error_message, self.file_path
+                ):
+                    break
+        else:
+            logging.error(f"Failed to reset after {MAX_RESET_RETRIES} attempts")
+
+        self.shutdown_on_error()
 
     def environment_step(self, action_env):
         """
@@ -137,10 +204,14 @@ class GripperTrainer:
                 state = self.environment.get_object_pose()
                 # Truncated should be false to prevent skipping the entire episode
                 return state, 0, False, False
-            else:
-                self.environment.gripper.close()
-                self.agent.save_models("error_models", self.file_path)
-                exit(1)
+            self.shutdown_on_error()
+
+    def shutdown_on_error(self):
+        # Terminal failure - release the gripper and keep the models trained so far
+        self.environment.gripper.close()
+        with self._agent_lock:
+            self.agent.save_models("error_models", self.file_path)
+        exit(1)
 
     def evaluation_loop(self, total_steps):
         """
@@ -153,6 +224,9 @@ class GripperTrainer:
 
         The method aims to evaluate the agent's performance by running the environment for a set number of steps and recording the average reward.
         """
+        # Evaluate the policy with every queued update applied
+        self.wait_for_training()
+
         frame = self.environment.grab_frame()
         self.record.start_video(total_steps + 1, frame)
 
@@ -167,22 +241,25 @@ class GripperTrainer:
             done = False
             truncated = False
 
-            start_time = time.time()
+            start_time = time.monotonic()
             while not done and not truncated:
                 episode_timesteps += 1
 
-                action = self.agent.select_action_from_policy(state, evaluation=True)
+                with self._agent_lock, torch.inference_mode():
+                    action = self.agent.select_action_from_policy(
+                        state, evaluation=True
+                    )
                 action_env = self.environment.denormalize(action)
 
                 state, reward, done, truncated = self.environment_step(action_env)
 
-                start_time = time.time()
+                start_time = time.monotonic()
 
                 episode_reward += reward
 
                 if eval_episode_counter == 0:
                     frame = self.environment.grab_frame()
-                    self.record.log_video(frame)
+                    self.log_video_frame(frame)
 
                 if done or truncated:
                     self.record.log_eval(
@@ -201,20 +278,134 @@ class GripperTrainer:
                 if self.gripper_config.action_type == "velocity":
                     self.dynamic_sleep(start_time)
 
+        self.stop_video()
+
+    def log_video_frame(self, frame):
+        """
+        Queues a frame to be written to the evaluation video on the video worker.
+
+        Camera frames are freshly allocated per capture so the worker can own them without copying.
+        """
+        if len(self._video_futures) >= MAX_PENDING_VIDEO_FRAMES:
+            self._video_futures.popleft().result()
+        self._video_futures.append(
+            self._video_pool.submit(self.record.log_video, frame)
+        )
+
+    def stop_video(self):
+        # All queued frames must be written before the video is closed
+        while self._video_futures:
+            self._video_futures.popleft().result()
         self.record.stop_video()
 
+    def run_policy_updates(self, iterations):
+        """
+        Runs policy updates, each on a minibatch sampled into the preallocated batch.
+
+        Args:
+        iterations (int): Number of minibatch updates to run.
+        """
+        batch_size = self.train_config.batch_size
+        is_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+        if is_debug:
+            start_train_time = time.monotonic()
+        for _ in range(iterations):
+            with self._memory_lock:
+                experiences = self.memory.sample_into(*self._batch, batch_size)
+            with self._agent_lock:
+                self.agent.train_policy(experiences)
+        if is_debug:
+            logging.debug(
+                "Time to run training loop %s \n",
+                time.monotonic() - start_train_time,
+            )
+
+    def request_training(self, iterations):
+        """
+        Queues policy updates for the trainer thread without blocking the environment.
+
+        Args:
+        iterations (int): Number of minibatch updates to run.
+
+        The request is dropped if the trainer thread is already too far behind.
+        """
+        self._check_trainer_error()
+
+        if self._train_thread is None:
+            self._train_thread = threading.Thread(
+                target=self._trainer_worker, daemon=True
+            )
+            self._train_thread.start()
+
+        try:
+            self._train_queue.put_nowait(iterations)
+        except queue.Full:
+            # Dropping updates lowers the effective G so it must never go unnoticed
+            if self._dropped_training_requests == 0:
+                logging.warning(
+                    "Trainer thread is behind, dropping %d updates", iterations
+                )
+            self._dropped_training_requests += 1
+
+    def wait_for_training(self):
+        # Blocks until every queued update has been applied
+        if self._train_thread is not None:
+            self._train_queue.join()
+        self._check_trainer_error()
+
+    def stop_training(self):
+        if self._train_thread is None:
+            return
+        self._train_queue.put(None)
+        self._train_thread.join()
+        self._train_thread = None
+        self._check_trainer_error()
+
+        if self._dropped_training_requests > 0:
+            logging.warning(
+                "Trainer thread fell behind, dropped %d requests (%d updates)",
+                self._dropped_training_requests,
+                self._dropped_training_requests * self.train_config.G,
+            )
+
+    def _check_trainer_error(self):
+        # A failed update is a terminal error like a gripper failure
+        if self._train_error is not None:
+            logging.error(f"Stopping after trainer thread failure: {self._train_error}")
+            self.shutdown_on_error()
+
+    def _trainer_worker(self):
+        while True:
+            iterations = self._train_queue.get()
+            try:
+                if iterations is None:
+                    return
+
+                # Keep draining after a failure so waiting on the queue never hangs
+                if self._train_error is not None:
+                    continue
+
+                # The preallocated batch is only used by this thread
+                self.run_policy_updates(iterations)
+            except Exception as error:
+                # Handled on the main thread at the next training request or wait
+                logging.error(f"Trainer thread failed with message: {error}")
+                self._train_error = error
+            finally:
+                self._train_queue.task_done()
+
     def train(self):
         """
         This method is the main training loop that is called to start training the agent a given environment.
         Trains the agent and save the results in a file and periodically evaluate the agent's performance as well as plotting results.
         Logging and messaging to a specified Slack Channel for monitoring the progress of the training.
         """
-        start_time = time.time()
+        start_time = time.monotonic()
 
         max_steps_training = self.train_config.max_steps_training
         max_steps_exploration = self.train_config.max_steps_exploration
         number_steps_per_evaluation = self.train_config.number_steps_per_evaluation
-        number_steps_per_train_policy = self.train_config.number_steps_per_train_policy
 
         # Algorthm specific attributes - e.g. NaSA-TD3 dd
         intrinsic_on = (
@@ -241,80 +432,229 @@ class GripperTrainer:
             f"Training {max_steps_training} Exploration {max_steps_exploration} Evaluation {number_steps_per_evaluation}"
         )
 
-        batch_size = self.train_config.batch_size
-        G = self.train_config.G
-
-        episode_timesteps = 0
-        episode_reward = 0
-        episode_num = 0
+        state = self.environment_reset()
+        episode = EpisodeProgress(start_time=time.monotonic())
+
+        exploration_end = min(int(max_steps_exploration), int(max_steps_training))
+        state, episode = self._run_exploration_phase(state, episode, 0, exploration_end)
+        self._run_learning_phase(
+            state,
+            episode,
+            exploration_end,
+            int(max_steps_training),
+            intrinsic_on,
+            noise_scale,
+            min_noise,
+            noise_decay,
+        )
 
-        evaluate = False
+        self.stop_training()
 
-        state = self.environment_reset()
+        end_time = time.monotonic()
+        elapsed_time = end_time - start_time
+        print("Training time:", time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
 
-        episode_start = time.time()
-        for total_step_counter in range(int(max_steps_training)):
-            episode_timesteps += 1
+    def _run_exploration_phase(self, state, episode, start_step, end_step):
+        """
+        Runs the random exploration steps, filling the memory without training the agent.
 
-            if total_step_counter < max_steps_exploration:
-                message = f"Running Exploration Steps {total_step_counter}/{max_steps_exploration}"
-                logging.info(message)
+        Args:
+        state: The state to start from.
+        episode (EpisodeProgress): Progress of the episode the phase continues.
+        start_step (int): First total step of the phase.
+        end_step (int): Total step the phase stops before.
 
-                action_env = self.environment.sample_action()
+        Returns:
+        tuple: The state and EpisodeProgress the phase finished on.
+        """
+        max_steps_exploration = self.train_config.max_steps_exploration
 
-                # algorithm range [-1, 1]
-                action = self.environment.normalize(action_env)
-            else:
-                noise_scale *= noise_decay
-                noise_scale = max(min_noise, noise_scale)
+        sample_action = self.environment.sample_action
+        normalize_into = self.environment.normalize_into
+        action_scratch = self._action_scratch
 
-                # returns a 1D array with range [-1, 1], only TD3 has noise scale
-                action = self.agent.select_action_from_policy(
-                    state, noise_scale=noise_scale
+        def choose_action(total_step_counter, state):
+            if total_step_counter % EXPLORATION_LOG_FREQUENCY == 0:
+                logging.info(
+                    "Running Exploration Steps %d/%d",
+                    total_step_counter,
+                    max_steps_exploration,
                 )
 
-                # gripper range
-                action_env = self.environment.denormalize(action)
+            action_env = sample_action()
+
+            # algorithm range [-1, 1]
+            action = normalize_into(action_scratch, action_env)
+            return action, action_env
+
+        return self._run_steps(
+            state,
+            episode,
+            start_step,
+            end_step,
+            choose_action,
+            _extrinsic_reward,
+            _skip_training,
+        )
+
+    def _run_learning_phase(
+        self,
+        state,
+        episode,
+        start_step,
+        end_step,
+        intrinsic_on,
+        noise_scale,
+        min_noise,
+        noise_decay,
+    ):
+        """
+        Runs the policy driven steps, training the agent as it goes.
+
+        Args:
+        state: The state to start from.
+        episode (EpisodeProgress): Progress of the episode the phase continues.
+        start_step (int): First total step of the phase.
+        end_step (int): Total step the phase stops before.
+        intrinsic_on (bool): Whether the agent's intrinsic reward is added to the stored reward.
+        noise_scale (float): Exploration noise, decayed before every step.
+        min_noise (float): Lower bound of the decayed noise.
+        noise_decay (float): Factor the noise is multiplied by every step.
+
+        Returns:
+        tuple: The state and EpisodeProgress the phase finished on.
+        """
+        number_steps_per_train_policy = self.train_config.number_steps_per_train_policy
+        G = self.train_config.G
+
+        denormalize_into = self.environment.denormalize_into
+        select_action_from_policy = self.agent.select_action_from_policy
+        agent_lock = self._agent_lock
+        action_env_scratch = self._action_env_scratch
+
+        # Updates run in the loop unless they are opted into the trainer thread
+        train_agent = (
+            self.request_training
+            if self.env_config.background_training
+            else self.run_policy_updates
+        )
+
+        def choose_action(total_step_counter, state):
+            nonlocal noise_scale
+            noise_scale *= noise_decay
+            noise_scale = max(min_noise, noise_scale)
+
+            # returns a 1D array with range [-1, 1], only TD3 has noise scale
+            # Acting never needs autograd so skip its bookkeeping entirely
+            with agent_lock, torch.inference_mode():
+                action = select_action_from_policy(state, noise_scale=noise_scale)
+
+            # gripper range - a list like denormalize, the scratch array is reused next step
+            action_env = denormalize_into(action_env_scratch, action).tolist()
+            return action, action_env
 
-            next_state, reward_extrinsic, done, truncated = self.environment_step(
-                action_env
+        def train_step(total_step_counter):
+            # Regardless if velocity or position based, train every step
+            if total_step_counter % number_steps_per_train_policy == 0:
+                train_agent(G)
+
+        reward_function = _extrinsic_reward
+        if intrinsic_on:
+            get_intrinsic_reward = self.agent.get_intrinsic_reward
+
+            def reward_function(state, action, next_state, reward_extrinsic):
+                with agent_lock:
+                    intrinsic_reward = get_intrinsic_reward(state, action, next_state)
+                return reward_extrinsic + intrinsic_reward
+
+            # The first learning step never receives an intrinsic reward
+            first_step_end = min(start_step + 1, end_step)
+            state, episode = self._run_steps(
+                state,
+                episode,
+                start_step,
+                first_step_end,
+                choose_action,
+                _extrinsic_reward,
+                train_step,
             )
+            start_step = first_step_end
+
+        return self._run_steps(
+            state,
+            episode,
+            start_step,
+            end_step,
+            choose_action,
+            reward_function,
+            train_step,
+        )
+
+    def _run_steps(
+        self,
+        state,
+        episode,
+        start_step,
+        end_step,
+        choose_action,
+        reward_function,
+        after_step,
+    ):
+        """
+        Runs training steps with the episode bookkeeping shared by every phase.
 
-            env_start_time = time.time()
+        Args:
+        state: The state to start from.
+        episode (EpisodeProgress): Progress of the episode the steps continue.
+        start_step (int): First total step to run.
+        end_step (int): Total step to stop before.
+        choose_action: Returns (action, action_env) from (total_step_counter, state).
+        reward_function: Returns the reward to store from
+        (state, action, next_state, reward_extrinsic).
+        after_step: Called with total_step_counter once the transition is stored.
 
-            intrinsic_reward = 0
-            if intrinsic_on and total_step_counter > max_steps_exploration:
-                intrinsic_reward = self.agent.get_intrinsic_reward(
-                    state, action, next_state
-                )
+        Returns:
+        tuple: The state and EpisodeProgress the steps finished on.
+        """
+        number_steps_per_evaluation = self.train_config.number_steps_per_evaluation
 
-            total_reward = reward_extrinsic + intrinsic_reward
+        # Bound to locals to keep attribute lookups out of the loop
+        is_velocity = self.gripper_config.action_type == "velocity"
+        environment_step = self.environment_step
+        memory_add = self.memory.add
+        memory_lock = self._memory_lock
 
-            self.memory.add(state, action, total_reward, next_state, done)
+        episode_num = episode.number
+        episode_timesteps = episode.timesteps
+        episode_reward = episode.reward
+        episode_start = episode.start_time
+        evaluate = episode.evaluate
+
+        for total_step_counter in range(start_step, end_step):
+            episode_timesteps += 1
+
+            action, action_env = choose_action(total_step_counter, state)
+
+            next_state, reward_extrinsic, done, truncated = environment_step(action_env)
+
+            env_start_time = time.monotonic()
+
+            total_reward = reward_function(state, action, next_state, reward_extrinsic)
+
+            with memory_lock:
+                memory_add(state, action, total_reward, next_state, done, truncated)
 
             state = next_state
             # Note we only track the extrinsic reward for the episode for proper comparison
             episode_reward += reward_extrinsic
 
-            # Regardless if velocity or position based, train every step
-            start_train_time = time.time()
-            if (
-                total_step_counter >= max_steps_exploration
-                and total_step_counter % number_steps_per_train_policy == 0
-            ):
-                for _ in range(G):
-                    experiences = self.memory.sample(batch_size)
-                    info = self.agent.train_policy(experiences)
-            end_train_time = time.time()
-            logging.debug(
-                f"Time to run training loop {end_train_time-start_train_time} \n"
-            )
+            after_step(total_step_counter)
 
             if (total_step_counter + 1) % number_steps_per_evaluation == 0:
                 evaluate = True
 
             if done or truncated:
-                episode_time = time.time() - episode_start
+                episode_time = time.monotonic() - episode_start
                 self.record.log_train(
                     total_steps=total_step_counter + 1,
                     episode=episode_num + 1,
@@ -336,20 +676,23 @@ class GripperTrainer:
                 episode_timesteps = 0
                 episode_reward = 0
                 episode_num += 1
-                episode_start = time.time()
+                episode_start = time.monotonic()
 
             # Run loop at a fixed frequency
-            if self.gripper_config.action_type == "velocity":
+            if is_velocity:
                 self.dynamic_sleep(env_start_time)
 
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print("Training time:", time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
+        episode = EpisodeProgress(
+            episode_num, episode_timesteps, episode_reward, episode_start, evaluate
+        )
+        return state, episode
 
     def dynamic_sleep(self, env_start):
-        process_time = time.time() - env_start
+        process_time = time.monotonic() - env_start
         logging.debug(
-            f"Time to process training loop: {process_time}/{self.env_config.step_time_period} secs"
+            "Time to process training loop: %s/%s secs",
+            process_time,
+            self.env_config.step_time_period,
         )
 
         delay = self.env_config.step_time_period - process_time
@@ -0,0 +1,122 @@
+import numpy as np
+import tools.utils as utils
+
+
+class SoAMemoryBuffer:
+    """
+    Replay buffer that stores each observation once in preallocated NumPy arrays.
+
+    Transition i keeps its state in slot i and its next_state in slot i + 1, which is the
+    state of the following transition. Only when an episode ends does the following state
+    differ, so the terminal next_state is kept on the side for that one transition.
+    One slot is always reserved for the pending next_state, so at most max_capacity - 1
+    transitions are held at once.
+
+    Like the cares_reinforcement_learning MemoryBuffer it replaces, batches are drawn
+    without replacement and hold at most len(buffer) transitions.
+
+    Args:
+    max_capacity (int): Number of slots in the buffer.
+    observation_size (int): Length of a single state.
+    action_num (int): Length of a single action.
+    """
+
+    def __init__(self, max_capacity, observation_size, action_num):
+        self.max_capacity = int(max_capacity)
+
+        self.states = np.zeros((self.max_capacity, observation_size), dtype=np.float32)
+        self.actions = np.zeros((self.max_capacity, action_num), dtype=np.float32)
+        self.rewards = np.zeros(self.max_capacity, dtype=np.float32)
+        # Bit 0 is done, bit 1 is truncated
+        self.flags = np.zeros(self.max_capacity, dtype=np.uint8)
+
+        # Terminal next states that could not be linked to the following slot
+        self.is_boundary = np.zeros(self.max_capacity, dtype=bool)
+        self.boundary_next_states = {}
+
+        self.write_index = 0
+        self.size = 0
+
+        self._rng = utils.create_rng()
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done, truncated=False):
+        index = self.write_index
+        next_index = (index + 1) % self.max_capacity
+
+        state = np.asarray(state, dtype=np.float32)
+
+        # A new episode started, keep the previous transition's terminal next_state before it is overwritten
+        if self.size > 0 and not np.array_equal(self.states[index], state):
+            previous_index = (index - 1) % self.max_capacity
+            self.boundary_next_states[previous_index] = self.states[index].copy()
+            self.is_boundary[previous_index] = True
+
+        self.states[index] = state
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.flags[index] = bool(done) | (bool(truncated) << 1)
+
+        # Writing next_state evicts the oldest transition held in that slot
+        self.boundary_next_states.pop(next_index, None)
+        self.is_boundary[next_index] = False
+        self.states[next_index] = next_state
+
+        self.write_index = next_index
+        self.size = min(self.size + 1, self.max_capacity - 1)
+
+    def sample(self, batch_size):
+        """
+        Samples a batch of transitions uniformly without replacement.
+
+        Returns:
+        tuple: states, actions, rewards, next_states and dones as float32 arrays.
+        """
+        return self.sample_into(
+            np.empty((batch_size, self.states.shape[1]), dtype=np.float32),
+            np.empty((batch_size, self.actions.shape[1]), dtype=np.float32),
+            np.empty(batch_size, dtype=np.float32),
+            np.empty((batch_size, self.states.shape[1]), dtype=np.float32),
+            np.empty(batch_size, dtype=np.float32),
+            batch_size,
+        )
+
+    def sample_into(
+        self,
+        out_states,
+        out_actions,
+        out_rewards,
+        out_next_states,
+        out_dones,
+        batch_size,
+    ):
+        """
+        Samples a batch of transitions into preallocated float32 arrays of length batch_size.
+
+        Returns:
+        tuple: Views of the filled rows of out_states, out_actions, out_rewards,
+        out_next_states and out_dones - fewer rows while the buffer is smaller.
+        """
+        batch_size = min(batch_size, self.size)
+        out_states = out_states[:batch_size]
+        out_actions = out_actions[:batch_size]
+        out_rewards = out_rewards[:batch_size]
+        out_next_states = out_next_states[:batch_size]
+        out_dones = out_dones[:batch_size]
+
+        offsets = self._rng.choice(self.size, size=batch_size, replace=False)
+        indices = (self.write_index - self.size + offsets) % self.max_capacity
+        next_indices = (indices + 1) % self.max_capacity
+
+        np.take(self.states, indices, axis=0, out=out_states)
+        np.take(self.actions, indices, axis=0, out=out_actions)
+        np.take(self.rewards, indices, out=out_rewards)
+        np.take(self.states, next_indices, axis=0, out=out_next_states)
+        np.bitwise_and(self.flags[indices], 1, out=out_dones, casting="unsafe")
+
+        for row in np.flatnonzero(self.is_boundary[indices]):
+            out_next_states[row] = self.boundary_next_states[indices[row]]
+
+        return out_states, out_actions, out_rewards, out_next_states, out_dones
@@ -1,9 +1,15 @@
 import os
 import shutil
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 
 
+def create_rng():
+    # Seeded from the global numpy state so np.random.seed keeps runs reproducible
+    return np.random.default_rng(np.random.randint(0, 2**31 - 1))
+
+
 def position_to_pixel(position, reference_position, camera_matrix):
     # pixel_n = f * N / Z + c_n
     pixel_x = (